@@ -18,19 +18,39 @@ You may obtain a copy of the License at
 """
 import collections
 import csv
-import itertools
+import functools
 import json
 import os
-import random
 from typing import List, Any, Dict, Tuple
 
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # pylint: disable=g-import-not-at-top
 import numpy as np
 import seaborn as sns
 
+try:
+  import orjson  # pylint: disable=g-import-not-at-top
+except ImportError:
+  orjson = None
+
 import loudness
 import data_generation
 
+# Buffer size of csv files and how many rows to write to them at once.
+_WRITE_BUFFER_SIZE = 1 << 20
+_ROWS_PER_WRITE = 10000
+
+# Colors that are cycled through in the line plots.
+_DEFAULT_COLOR_CYCLE = (
+    "#1f77b4", "#aec7e8", "#ff7f0e", "#ffbb78", "#2ca02c",
+    "#98df8a", "#d62728", "#ff9896", "#9467bd", "#c5b0d5",
+    "#8c564b", "#c49c94", "#e377c2", "#f7b6d2", "#7f7f7f",
+    "#c7c7c7", "#bcbd22", "#dbdb8d", "#17becf", "#9edae5")
+
+# Figures that are reused between plots, keyed by the kind of plot.
+_FIGURES = {}
+
 
 def find_stft_bin(frequency: float, window_size=2048, sample_rate=44100) -> int:
   """Finds the correct bin for a frequency in a signal processed by a STFT.
@@ -50,26 +70,53 @@ def find_stft_bin(frequency: float, window_size=2048, sample_rate=44100) -> int:
   return int(frequency / step_size)
 
 
+def find_stft_bins(frequencies: np.ndarray, window_size=2048,
+                   sample_rate=44100) -> np.ndarray:
+  """Finds the correct bins for an array of frequencies, see find_stft_bin.
+
+  Args:
+    frequencies: frequencies to look for
+    window_size: window size used in STFT
+    sample_rate: sample rate of signal processed by STFT
+
+  Returns:
+    Array with the index of the bin containing each frequency.
+  """
+  step_size = sample_rate / window_size
+  return (np.asarray(frequencies, dtype=np.float64) / step_size).astype(
+      np.int64)
+
+
+def _reused_figure(name: str) -> Tuple[plt.Figure, plt.Axes]:
+  """Returns a cleared figure with a single axes that is reused per name."""
+  if name not in _FIGURES:
+    _FIGURES[name] = plt.figure()
+  fig = _FIGURES[name]
+  fig.clear()
+  return fig, fig.add_subplot(1, 1, 1)
+
+
 def plot_histogram(values: List[Any], path: str, bins=None, logscale=False,
-                   x_label="", title=""):
+                   x_label="", title="", ax=None):
   """Plots and saves a histogram."""
-  _, ax = plt.subplots(1, 1)
+  if ax is None:
+    _, ax = _reused_figure("histogram")
   if not bins:
     ax.hist(values, histtype="stepfilled", alpha=0.2)
   else:
     ax.hist(values, bins=bins, histtype="stepfilled", alpha=0.2)
   if logscale:
-    plt.xscale("log")
+    ax.set_xscale("log")
   ax.set_ylabel("Occurrence Count")
   ax.set_xlabel(x_label)
   ax.set_title(title)
-  plt.savefig(path)
+  ax.figure.savefig(path)
 
 
 def plot_histograms(plot_directory: str,
-                    covered_frequencies: List[float], covered_phons: List[int],
-                    covered_num_tones: List[int],
-                    covered_levels: List[int]):
+                    covered_frequencies: np.ndarray, covered_phons: np.ndarray,
+                    covered_num_tones: np.ndarray,
+                    covered_levels: np.ndarray):
   """Plots and saves multiple histograms."""
   plot_histogram(covered_phons, os.path.join(plot_directory, "phons_hist.png"),
                  x_label="Loudness (phons)",
@@ -91,7 +138,7 @@ def plot_histograms(plot_directory: str,
 
 def plot_heatmap(data: np.ndarray, path: str):
   """Plots and saves a heatmap of critical band co-occurrences."""
-  fig, ax = plt.subplots()
+  fig, ax = _reused_figure("heatmap")
   fig.set_size_inches(18.5, 18.5)
   # We want to show all ticks...
   ax.set_xticks(np.arange(data.shape[1]))
@@ -101,66 +148,75 @@ def plot_heatmap(data: np.ndarray, path: str):
   ax.set_xticklabels(labels)
   ax.set_yticklabels(labels)
   ax.set_title("Count per combination of Critical Bands in Examples")
-  sns.heatmap(data, annot=True, fmt="d", xticklabels=labels, yticklabels=labels,
-              ax=ax)
-  plt.savefig(path)
+  # Only annotate non-zero cells, empty annotations are not drawn.
+  annotations = np.where(data > 0, data.astype(str), "")
+  sns.heatmap(data, annot=annotations, fmt="", xticklabels=labels,
+              yticklabels=labels, ax=ax)
+  fig.savefig(path)
 
 
 def plot_average_num_tones(data: Dict[int, Dict[int, int]],
                            path: str):
   """Plots and saves a histogram of number of tones per example."""
   plt.subplots()
-  all_bins = []
-  all_counts = []
-  for frequency_bin, counts in data.items():
-    average = sum(
-        [key * value for key, value in counts.items()]) / sum(
-            [value for _, value in counts.items()])
-    all_bins.append(frequency_bin)
-    all_counts.append(average)
+  all_bins = np.empty(len(data), dtype=np.int64)
+  all_counts = np.empty(len(data), dtype=np.float64)
+  for i, (frequency_bin, counts) in enumerate(data.items()):
+    keys = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    all_bins[i] = frequency_bin
+    all_counts[i] = float(np.dot(keys, values)) / float(values.sum())
   plt.scatter(all_bins, all_counts)
   plt.savefig(path)
 
 
-def write_examples(examples: List[List[str]],
+def write_examples(examples: List[Tuple[str, str]],
                    file_name: str, path: str, example_ids=List[int],
                    seed=1) -> str:
   """Write tone-tone-set examples to csv."""
-  random.seed(seed)
+  rng = np.random.default_rng(seed)
   # Get a random ordering and write the examples to a csv file in that order.
-  example_order = list(range(len(examples)))
-  random.shuffle(example_order)
+  example_order = rng.permutation(len(examples)).tolist()
   save_path = os.path.join(path, file_name + ".csv")
-  with open(save_path, "wt") as infile:
+  with open(save_path, "wt", newline="",
+            buffering=_WRITE_BUFFER_SIZE) as infile:
     csv_writer = csv.writer(infile, delimiter=",")
     csv_writer.writerow(["id", "single_tone", "combined_tones"])
-    with open(os.path.join(path, file_name + "_ids.csv"),
-                    "w") as infile_ids:
-      csv_writer_ids = csv.writer(infile_ids, delimiter=",")
-      num_examples = 0
-      for i in example_order:
-        example = examples[i]
-        example_id = example_ids[i]
-        num_examples += 1
-        csv_writer.writerow([num_examples, example[0], example[1]])
-
-        # If the example is an ISO reproduction example save its ID in a
-        # separate csv file.
-        if example_id:
-          csv_writer_ids.writerow([num_examples])
+    num_examples = 0
+    rows = []
+    id_rows = []
+    for i in example_order:
+      example = examples[i]
+      example_id = example_ids[i]
+      num_examples += 1
+      rows.append((num_examples, example[0], example[1]))
+      if len(rows) >= _ROWS_PER_WRITE:
+        csv_writer.writerows(rows)
+        rows.clear()
+
+      # If the example is an ISO reproduction example save its ID in a
+      # separate csv file.
+      if example_id:
+        id_rows.append((num_examples,))
+    csv_writer.writerows(rows)
+  ids_path = os.path.join(path, file_name + "_ids.csv")
+  if id_rows:
+    with open(ids_path, "w", newline="",
+              buffering=_WRITE_BUFFER_SIZE) as infile_ids:
+      csv.writer(infile_ids, delimiter=",").writerows(id_rows)
+  elif os.path.exists(ids_path):
+    # Don't leave ids of a previous run that refer to the wrong examples.
+    os.remove(ids_path)
   return save_path
 
 
-def write_data_specifications(data: Dict[str, Any],
+def write_data_specifications(data: Dict[Tuple[float, int], Any],
                               file_name: str, path: str, plot: bool) -> str:
   """Write specifics of curves to make with a dataset."""
   save_path = os.path.join(path, file_name)
   with open(save_path, "w") as infile:
     curve_data = []
-    for curve_representation, masker_curves in data.items():
-      curve_representation = curve_representation.split(",")
-      masker_frequency = curve_representation[0]
-      probe_level = curve_representation[1]
+    for (masker_frequency, probe_level), masker_curves in data.items():
       masker_probe_curve_data = {"masker_frequency": float(masker_frequency),
                                  "probe_level": int(probe_level),
                                  "curves": []}
@@ -178,10 +234,46 @@ def write_data_specifications(data: Dict[str, Any],
       curve_data.append(masker_probe_curve_data)
     if plot:
       plot_masking_patterns(curve_data, path)
-    json.dump(curve_data, infile, indent=4)
+    if orjson is not None:
+      infile.write(orjson.dumps(
+          curve_data,
+          option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode())
+    else:
+      infile.write(json.dumps(curve_data, indent=2))
   return save_path
 
 
+def _find_critical_bands(critical_bands: List[int],
+                         frequencies: np.ndarray) -> np.ndarray:
+  """Finds the index of the critical band each frequency falls in.
+
+  Args:
+    critical_bands: the boundaries of each cb are at index i and i + 1
+    frequencies: the frequencies to find the critical band of
+
+  Returns:
+    Array with the critical band index of each frequency.
+
+  Raises:
+    IndexError: if a frequency falls outside of the critical bands.
+  """
+  cbs = np.searchsorted(critical_bands, frequencies, side="right") - 1
+  if np.any((cbs < 0) | (cbs > len(critical_bands) - 2)):
+    raise IndexError(
+        "Frequencies outside of the critical bands [{}, {}).".format(
+            critical_bands[0], critical_bands[-1]))
+  return cbs
+
+
+def _count_critical_band_pairs(cbs_rows: np.ndarray, cbs_columns: np.ndarray,
+                               num_critical_bands: int) -> np.ndarray:
+  """Counts how often each pair of critical bands occurs in a matrix."""
+  return np.bincount(
+      cbs_rows * num_critical_bands + cbs_columns,
+      minlength=num_critical_bands * num_critical_bands).reshape(
+          num_critical_bands, num_critical_bands).astype(np.int32)
+
+
 def save_two_tone_set(data: List[data_generation.ProbeMaskerPair],
                       iso_data: Dict[int, Dict[str, Any]],
                       critical_bands: List[int],
@@ -202,12 +294,19 @@ def save_two_tone_set(data: List[data_generation.ProbeMaskerPair],
       lambda: collections.defaultdict(list))
   curves_maskers = collections.defaultdict(
       lambda: collections.defaultdict(list))
-  cb_combinations_probes = np.zeros(
-      [len(critical_bands) - 1,
-       len(critical_bands) - 1], dtype=int)
-  cb_combinations_maskers = np.zeros(
-      [len(critical_bands) - 1,
-       len(critical_bands) - 1], dtype=int)
+  num_critical_bands = len(critical_bands) - 1
+
+  # Find the corresponding critical bands for visualization purposes.
+  masker_tones = np.fromiter((pair.masker.tone for pair in data),
+                             dtype=np.float64, count=len(data))
+  probe_tones = np.fromiter((pair.probe.tone for pair in data),
+                            dtype=np.float64, count=len(data))
+  cbs_maskers = _find_critical_bands(critical_bands, masker_tones)
+  cbs_probes = _find_critical_bands(critical_bands, probe_tones)
+  cb_combinations_probes = _count_critical_band_pairs(
+      cbs_maskers, cbs_probes, num_critical_bands)
+  cb_combinations_maskers = _count_critical_band_pairs(
+      cbs_probes, cbs_maskers, num_critical_bands)
 
   # Prepare the tuples of tones that each should make up two examples.
   for probe_masker_pair in data:
@@ -217,14 +316,6 @@ def save_two_tone_set(data: List[data_generation.ProbeMaskerPair],
                                                   masker_tone_level.level)
     probe_tone_representation = "[{},{}]".format(probe_tone_level.tone,
                                                  probe_tone_level.level)
-
-    # Find the corresponding critical band for visualization purposes
-    cb_masker = data_generation.binary_search(critical_bands,
-                                              masker_tone_level.tone)
-    cb_probe = data_generation.binary_search(critical_bands,
-                                             probe_tone_level.tone)
-    cb_combinations_probes[cb_masker][cb_probe] += 1
-    cb_combinations_maskers[cb_probe][cb_masker] += 1
     covered_levels_maskers.append(masker_tone_level.level)
     covered_levels_probes.append(probe_tone_level.level)
     covered_frequencies_maskers.append(masker_tone_level.tone)
@@ -234,18 +325,18 @@ def save_two_tone_set(data: List[data_generation.ProbeMaskerPair],
 
     # Append two examples, one for each tone as the probe tone.
     examples_maskers.append(
-        [masker_tone_representation, combined_representation])
-    examples_probes.append([probe_tone_representation, combined_representation])
+        (masker_tone_representation, combined_representation))
+    examples_probes.append((probe_tone_representation, combined_representation))
 
     # These examples are normal examples and not ISO standard reproduction ones.
     example_ids_probes.append(0)
     example_ids_maskers.append(0)
 
     # Append data statistics
-    probe_curve_representation = "{},{}".format(masker_tone_level.tone,
-                                                probe_tone_level.level)
-    masker_curve_representation = "{},{}".format(probe_tone_level.tone,
-                                                 masker_tone_level.level)
+    probe_curve_representation = (masker_tone_level.tone,
+                                  probe_tone_level.level)
+    masker_curve_representation = (probe_tone_level.tone,
+                                   masker_tone_level.level)
     curves_probes[probe_curve_representation][masker_tone_level.level].append(
         probe_tone_level.tone)
     curves_maskers[masker_curve_representation][probe_tone_level.level].append(
@@ -253,14 +344,13 @@ def save_two_tone_set(data: List[data_generation.ProbeMaskerPair],
 
   # Prepare the iso reproduction examples.
   for examples in iso_data.values():
-    level = examples["ref1000_spl"]
-    combined_tone_representation = "[[{},{}]]".format(1000, level)
-    for other_tone in examples["other_tones"]:
-      single_tone_representation = "[{},{}]".format(
-          other_tone["frequency"], other_tone["level"])
-      examples_probes.append([single_tone_representation,
-                              combined_tone_representation])
-      example_ids_probes.append(1)
+    combined_tone_representation = f"[[1000,{examples['ref1000_spl']}]]"
+    other_tones = examples["other_tones"]
+    examples_probes.extend([
+        (f"[{tone['frequency']},{tone['level']}]", combined_tone_representation)
+        for tone in other_tones
+    ])
+    example_ids_probes.extend([1] * len(other_tones))
 
   # Plot statistics on the data examples.
   plot_heatmap(cb_combinations_probes,
@@ -304,38 +394,43 @@ def save_two_tone_set(data: List[data_generation.ProbeMaskerPair],
   return probes_path, probes_specs_path, maskers_path, maskers_specs_path
 
 
+@functools.lru_cache(maxsize=None)
+def _levels_per_phons(phons_levels: Tuple[int, ...],
+                      frequencies: Tuple[int, ...]) -> np.ndarray:
+  """Computes the SPL of each frequency on the ISO curve of each phons level.
+
+  Args:
+    phons_levels: the loudness levels of the curves
+    frequencies: the frequencies to compute the SPL for
+
+  Returns:
+    Array of shape [len(phons_levels), len(frequencies)] with SPLs in dB.
+  """
+  return loudness.loudness_to_spl(
+      np.array(phons_levels, dtype=np.float64)[:, np.newaxis],
+      np.array(frequencies, dtype=np.float64)[np.newaxis, :])
+
+
 def plot_iso_examples(data: Dict[int, Dict[str, Any]], path: str):
   """Plot ISO equal loudness curves w/ markers for the data examples."""
   _, ax = plt.subplots(1, 1, figsize=(12, 14))
   frequencies_on_range = [i for i in range(20, 20000, 10)]
-
-  # These are the colors that will be used in the plot
-  colors = [
-      "#1f77b4", "#aec7e8", "#ff7f0e", "#ffbb78", "#2ca02c",
-      "#98df8a", "#d62728", "#ff9896", "#9467bd", "#c5b0d5",
-      "#8c564b", "#c49c94", "#e377c2", "#f7b6d2", "#7f7f7f",
-      "#c7c7c7", "#bcbd22", "#dbdb8d", "#17becf", "#9edae5"]
-  ax.set_prop_cycle(color=colors)
+  ax.set_prop_cycle(color=list(_DEFAULT_COLOR_CYCLE))
   plt.xscale("log")
   ax.set_xlabel("Frequency (Hz)")
   ax.set_ylabel("SPL (dB)")
   ax.set_title("ISO equal loudness curves")
   phons_levels = [i * 10 for i in range(10)]
   legend_handles = ["{} Phons".format(phons) for phons in phons_levels]
-  levels_per_phons = []
-  for phons in phons_levels:
-    levels = []
-    for frequency in frequencies_on_range:
-      level = loudness.loudness_to_spl(phons, frequency)
-      levels.append(level)
-    levels_per_phons.append(levels)
+  levels_per_phons = _levels_per_phons(tuple(phons_levels),
+                                       tuple(frequencies_on_range))
   for i, y in enumerate(levels_per_phons):
     plt.plot(frequencies_on_range, y, label=legend_handles[i])
 
   for i, examples in enumerate(data.values()):
     level = examples["ref1000_spl"]
     plt.scatter(1000, level, marker="x", c="b")
-    color = colors[i]
+    color = _DEFAULT_COLOR_CYCLE[i]
     for other_tone in examples["other_tones"]:
       if "error" in other_tone:
         plt.errorbar(other_tone["frequency"], other_tone["level"],
@@ -354,12 +449,7 @@ def plot_masking_patterns(curves: List[Dict[str, Any]],
     masker_frequency = masker_freq_probe_level["masker_frequency"]
     probe_level = masker_freq_probe_level["probe_level"]
     _, ax = plt.subplots(1, 1, figsize=(12, 14))
-    ax.set_prop_cycle(color=[
-        "#1f77b4", "#aec7e8", "#ff7f0e", "#ffbb78", "#2ca02c", "#98df8a",
-        "#d62728", "#ff9896", "#9467bd", "#c5b0d5", "#8c564b", "#c49c94",
-        "#e377c2", "#f7b6d2", "#7f7f7f", "#c7c7c7", "#bcbd22", "#dbdb8d",
-        "#17becf", "#9edae5"
-    ])
+    ax.set_prop_cycle(color=list(_DEFAULT_COLOR_CYCLE))
     plt.xscale("log")
     ax.set_xlabel("Probe Frequency (Hz)")
     ax.set_ylabel("Masked SPL (dB)")
@@ -371,8 +461,13 @@ def plot_masking_patterns(curves: List[Dict[str, Any]],
       masker_level = masker_curve["masker_level"]
       frequencies = masker_curve["probe_frequencies"]
       masking = masker_curve["probe_masking"]
-      average_masking = [np.mean(np.array(m)) for m in masking]
-      std_masking = [np.std(np.array(m)) for m in masking]
+      # Pad the (possibly ragged) masking values with NaN to a single array.
+      max_num_values = max((len(m) for m in masking), default=0)
+      padded_masking = np.full((len(masking), max_num_values), np.nan)
+      for i, m in enumerate(masking):
+        padded_masking[i, :len(m)] = m
+      average_masking = np.nanmean(padded_masking, axis=1)
+      std_masking = np.nanstd(padded_masking, axis=1)
       plt.errorbar(
           frequencies,
           average_masking,
@@ -388,19 +483,20 @@ def plot_masking_patterns(curves: List[Dict[str, Any]],
 
 def save_iso_reproduction_examples(data: Dict[int, Dict[str, Any]], path: str):
   """Save the ISO reproduction examples in a csv file."""
-  with open(os.path.join(path, "data_iso_repro.csv"), "w") as infile:
+  with open(os.path.join(path, "data_iso_repro.csv"), "w", newline="",
+            buffering=_WRITE_BUFFER_SIZE) as infile:
     csv_writer = csv.writer(infile, delimiter=",")
     csv_writer.writerow(["id", "single_tone", "combined_tones"])
-    num_examples = 0
-    for _, examples in data.items():
-      level = examples["ref1000_spl"]
-      combined_tone_representation = "[[{},{}]]".format(1000, level)
-      for other_tone in examples["other_tones"]:
-        num_examples += 1
-        single_tone_representation = "[{},{}]".format(
-            other_tone["frequency"], other_tone["level"])
-        csv_writer.writerow([num_examples, single_tone_representation,
-                             combined_tone_representation])
+    all_tones = []
+    for examples in data.values():
+      combined_tone_representation = f"[[1000,{examples['ref1000_spl']}]]"
+      all_tones.extend((other_tone, combined_tone_representation)
+                       for other_tone in examples["other_tones"])
+    csv_writer.writerows([
+        (i + 1, f"[{tone['frequency']},{tone['level']}]",
+         combined_tone_representation)
+        for i, (tone, combined_tone_representation) in enumerate(all_tones)
+    ])
 
 
 def save_data(data: Dict[int, List[Dict[str, List[int]]]], path: str,
@@ -419,51 +515,92 @@ def save_data(data: Dict[int, List[Dict[str, List[int]]]], path: str,
     different probe tone.
   """
   # Some structures to keep track of data statistics.
-  total_unique_examples = 0
   total_num_examples_listeners = 0
-  covered_frequencies = []
-  covered_phons = []
-  covered_levels = []
-  covered_num_tones = []
   covered_num_tones_per_cb = collections.defaultdict(
       lambda: collections.defaultdict(int))
-  _ = collections.defaultdict(
-      lambda: collections.defaultdict(int))
-  cb_combinations = np.zeros([len(critical_bands) - 1, len(critical_bands) - 1],
-                             dtype=int)
+  def gather(field: str) -> np.ndarray:
+    """Gathers a field of all examples in one flat array, in saving order."""
+    return np.array([
+        value for examples in data.values() for example in examples
+        for value in example[field]
+    ], dtype=np.float64)
+
+  # The statistics below stack the examples per number of tones, which only
+  # lines up if every example in data[num_tones] has exactly num_tones tones.
+  for num_tones, examples in data.items():
+    for example in examples:
+      if (len(example["frequencies"]) != num_tones or
+          len(example["levels"]) != num_tones):
+        raise ValueError(
+            "Example with {} tones stored under {} tones: {}".format(
+                len(example["frequencies"]), num_tones, example))
+
+  # Lay out the examples and their tones as flat arrays.
+  covered_num_tones = np.repeat(
+      np.array(list(data.keys()), dtype=np.int64),
+      np.array([len(examples) for examples in data.values()], dtype=np.int64))
+  total_unique_examples = len(covered_num_tones)
+  covered_frequencies = gather("frequencies")
+  covered_levels = gather("levels")
+  covered_phons = gather("phons")
+  num_tones_per_tone = np.repeat(covered_num_tones, covered_num_tones)
+
+  # Find the critical band of every tone in the data at once and count how
+  # often each number of tones occurs per critical band.
+  all_critical_bands = _find_critical_bands(critical_bands,
+                                            covered_frequencies)
+  if total_unique_examples:
+    cb_num_tones, counts = np.unique(
+        np.stack([all_critical_bands, num_tones_per_tone]), axis=1,
+        return_counts=True)
+    for (cb, num_tones), count in zip(cb_num_tones.T.tolist(),
+                                      counts.tolist()):
+      covered_num_tones_per_cb[cb][num_tones] = count
 
   # Go over the data and save it in the right format in a csv file.
-  with open(os.path.join(path, "data.csv"), "w") as infile:
+  with open(os.path.join(path, "data.csv"), "w", newline="",
+            buffering=_WRITE_BUFFER_SIZE) as infile:
     csv_writer = csv.writer(infile, delimiter=",")
     csv_writer.writerow(["id", "single_tone", "combined_tones"])
-    for num_tones, examples in data.items():
+    rows = []
+    for examples in data.values():
       for example in examples:
-        covered_num_tones.append(num_tones)
-        total_unique_examples += 1
-        frequencies = example["frequencies"]
-        levels = example["levels"]
-        phons = example["phons"]
-        covered_phons.extend(phons)
-        current_critical_bands = []
-        combined_tone_representation = []
-        for frequency, level in zip(frequencies, levels):
-          combined_tone_representation.append("[{},{}]".format(frequency,
-                                                               level))
-        combined_tone_representation = ",".join(combined_tone_representation)
-        combined_tone_representation = "[" + combined_tone_representation + "]"
-        for frequency, level in zip(frequencies, levels):
+        tone_representations = [
+            f"[{frequency},{level}]"
+            for frequency, level in zip(example["frequencies"],
+                                        example["levels"])
+        ]
+        combined_tone_representation = "[" + ",".join(
+            tone_representations) + "]"
+        for tone_representation in tone_representations:
           total_num_examples_listeners += 1
-          csv_writer.writerow([total_num_examples_listeners,
-                               "[{},{}]".format(frequency, level),
-                               combined_tone_representation])
-          cb = data_generation.binary_search(critical_bands, frequency)
-          covered_num_tones_per_cb[cb][num_tones] += 1
-          current_critical_bands.append(cb)
-          covered_frequencies.append(frequency)
-          covered_levels.append(level)
-        for cb_1, cb_2 in itertools.combinations(current_critical_bands, r=2):
-          cb_combinations[cb_1][cb_2] += 1
-          cb_combinations[cb_2][cb_1] += 1
+          rows.append((total_num_examples_listeners, tone_representation,
+                       combined_tone_representation))
+        if len(rows) >= _ROWS_PER_WRITE:
+          csv_writer.writerows(rows)
+          rows.clear()
+    csv_writer.writerows(rows)
+
+  # Gather critical band pairs per number of tones, since all examples
+  # with the same number of tones can be stacked in a single matrix.
+  all_cbs_first = [np.empty(0, dtype=np.int64)]
+  all_cbs_second = [np.empty(0, dtype=np.int64)]
+  offset = 0
+  for num_tones, examples in data.items():
+    num_group_tones = num_tones * len(examples)
+    cbs_per_example = np.reshape(
+        all_critical_bands[offset:offset + num_group_tones],
+        (len(examples), num_tones))
+    offset += num_group_tones
+    first, second = np.triu_indices(num_tones, k=1)
+    all_cbs_first.append(cbs_per_example[:, first].ravel())
+    all_cbs_second.append(cbs_per_example[:, second].ravel())
+
+  # Count each pair in both directions to get a symmetric matrix.
+  cbs_pairs_first = np.concatenate(all_cbs_first + all_cbs_second)
+  cbs_pairs_second = np.concatenate(all_cbs_second + all_cbs_first)
+  cb_combinations = _count_critical_band_pairs(
+      cbs_pairs_first, cbs_pairs_second, len(critical_bands) - 1)
   plot_histograms(path, covered_frequencies, covered_phons, covered_num_tones,
                   covered_levels)
   plot_heatmap(cb_combinations, os.path.join(path, "cb_heatmap.png"))
@@ -475,21 +612,10 @@ def plot_loudness_conversion(path: str, phons_levels: List[int],
                              frequencies: List[int]):
   """PLot ISO loudness curves with loudness to decibel conversion."""
   _, ax = plt.subplots(1, 1, figsize=(12, 14))
-
-  # These are the colors that will be used in the plot
-  ax.set_prop_cycle(color=[
-      "#1f77b4", "#aec7e8", "#ff7f0e", "#ffbb78", "#2ca02c",
-      "#98df8a", "#d62728", "#ff9896", "#9467bd", "#c5b0d5",
-      "#8c564b", "#c49c94", "#e377c2", "#f7b6d2", "#7f7f7f",
-      "#c7c7c7", "#bcbd22", "#dbdb8d", "#17becf", "#9edae5"])
+  ax.set_prop_cycle(color=list(_DEFAULT_COLOR_CYCLE))
   plt.xscale("log")
-  levels_per_phons = []
-  for phons in phons_levels:
-    levels = []
-    for frequency in frequencies:
-      level = loudness.loudness_to_spl(phons, frequency)
-      levels.append(level)
-    levels_per_phons.append(levels)
+  levels_per_phons = _levels_per_phons(tuple(phons_levels),
+                                       tuple(frequencies))
   for y in levels_per_phons:
     plt.plot(frequencies, y)
   plt.savefig(path)
@@ -16,10 +16,13 @@ You may obtain a copy of the License at
   limitations under the License.
 """
 import csv
+import itertools
 import json
 import os
+from unittest import mock
 
 from absl.testing import absltest
+import numpy as np
 
 import unittest
 import data_analysis
@@ -53,6 +56,24 @@ class DataAnalysisTest(unittest.TestCase):
     actual_bin = data_analysis.find_stft_bin(frequency)
     self.assertEqual(expected_bin, actual_bin)
 
+  def test_find_frequency_bins(self):
+    frequencies = [21, 119, 20000]
+    expected_bins = [0, 5, 928]
+    actual_bins = data_analysis.find_stft_bins(frequencies)
+    self.assertListEqual(expected_bins, actual_bins.tolist())
+
+  def test_find_frequency_bins_matches_find_frequency_bin(self):
+    frequencies = [-119.5, 0, 21, 119, 308.7, 1000.3, 20000]
+    for window_size in [256, 1000, 2048, 4096]:
+      for sample_rate in [16000, 22050, 44100, 48000]:
+        expected_bins = [
+            data_analysis.find_stft_bin(frequency, window_size, sample_rate)
+            for frequency in frequencies
+        ]
+        actual_bins = data_analysis.find_stft_bins(frequencies, window_size,
+                                                   sample_rate)
+        self.assertListEqual(expected_bins, actual_bins.tolist())
+
   def test_save_two_tone_set(self):
     critical_bands = [0, 50, 100, 200, 500, 2000]
     masker_levels = [30, 80]
@@ -152,6 +173,101 @@ class DataAnalysisTest(unittest.TestCase):
       for i, curve in enumerate(probes_specs):
         self.assertEqual(curve, expected_curves[i])
 
+  def test_save_two_tone_set_iso_ids(self):
+    critical_bands = [0, 50, 100, 200, 500, 2000]
+    examples = data_generation.generate_two_tone_set(
+        critical_bands,
+        masker_levels=[30],
+        probe_levels=[40],
+        critical_bands_apart_probe=4,
+        critical_bands_apart_masker=3,
+        all_lower_probes=1,
+        all_higher_probes=2)
+    iso_data = {
+        40: {"ref1000_spl": 40,
+             "other_tones": [{"frequency": 100, "level": 52},
+                             {"frequency": 4000, "level": 37}]},
+        60: {"ref1000_spl": 60,
+             "other_tones": [{"frequency": 100, "level": 70}]}
+    }
+    expected_iso_combined_tones = {"[[1000,40]]", "[[1000,60]]"}
+
+    # An ids file of an earlier run should not survive a run without ids.
+    maskers_ids_path = os.path.join(self.save_directory,
+                                    "maskers_two_tone_set_ids.csv")
+    with open(maskers_ids_path, "w") as outfile:
+      outfile.write("2\n3\n")
+
+    probes_path, _, _, _ = data_analysis.save_two_tone_set(
+        examples, iso_data, critical_bands, self.save_directory)
+
+    expected_ids = []
+    with open(probes_path, "r") as probes_infile:
+      for example in csv.reader(probes_infile, delimiter=","):
+        if example[2] in expected_iso_combined_tones:
+          expected_ids.append(example[0])
+    self.assertEqual(len(expected_ids), 3)
+    with open(os.path.join(self.save_directory,
+                           "probes_two_tone_set_ids.csv"), "r") as ids_infile:
+      actual_ids = [row[0] for row in csv.reader(ids_infile, delimiter=",")]
+    self.assertListEqual(expected_ids, actual_ids)
+    self.assertFalse(os.path.exists(maskers_ids_path))
+
+  def test_save_data(self):
+    critical_bands = [0, 100, 200, 500, 1000]
+    data = {
+        1: [{"frequencies": [50], "levels": [30], "phons": [20]}],
+        2: [{"frequencies": [50, 150], "levels": [40, 45], "phons": [30, 35]}],
+        3: [{"frequencies": [150, 250, 600], "levels": [50, 55, 60],
+             "phons": [40, 45, 50]},
+            {"frequencies": [60, 70, 900], "levels": [10, 20, 30],
+             "phons": [10, 20, 30]}]
+    }
+
+    # Calculate the expected statistics tone by tone.
+    expected_rows = [["id", "single_tone", "combined_tones"]]
+    expected_cb_combinations = np.zeros([4, 4], dtype=int)
+    for examples in data.values():
+      for example in examples:
+        tones = ["[{},{}]".format(frequency, level) for frequency, level in
+                 zip(example["frequencies"], example["levels"])]
+        for tone in tones:
+          expected_rows.append([str(len(expected_rows)), tone,
+                                "[" + ",".join(tones) + "]"])
+        cbs = [data_generation.binary_search(critical_bands, frequency)
+               for frequency in example["frequencies"]]
+        for cb_1, cb_2 in itertools.combinations(cbs, r=2):
+          expected_cb_combinations[cb_1][cb_2] += 1
+          expected_cb_combinations[cb_2][cb_1] += 1
+    expected_num_tones_per_cb = {
+        0: {1: 1, 2: 1, 3: 2},
+        1: {2: 1, 3: 1},
+        2: {3: 1},
+        3: {3: 2}
+    }
+
+    with mock.patch.object(data_analysis, "plot_histograms"), \
+        mock.patch.object(data_analysis, "plot_heatmap") as plot_heatmap:
+      (covered_num_tones_per_cb, total_unique_examples,
+       total_num_examples_listeners) = data_analysis.save_data(
+           data, self.save_directory, critical_bands)
+      actual_cb_combinations = plot_heatmap.call_args[0][0]
+
+    self.assertEqual(total_unique_examples, 4)
+    self.assertEqual(total_num_examples_listeners, 9)
+    self.assertDictEqual(
+        {cb: dict(counts) for cb, counts in covered_num_tones_per_cb.items()},
+        expected_num_tones_per_cb)
+    self.assertListEqual(expected_cb_combinations.tolist(),
+                         actual_cb_combinations.tolist())
+    with open(os.path.join(self.save_directory, "data.csv"), "r") as infile:
+      self.assertListEqual(expected_rows, list(csv.reader(infile)))
+
+  def test_save_data_wrong_number_of_tones(self):
+    data = {2: [{"frequencies": [50], "levels": [30], "phons": [20]}]}
+    with self.assertRaises(ValueError):
+      data_analysis.save_data(data, self.save_directory, [0, 100, 200])
+
 
 if __name__ == "__main__":
   unittest.main()